@@ -1,7 +1,7 @@
 import logging
 from flask import Flask, request, jsonify
 import os
-from aws_ndvi_processor import AWSNDVIProcessor
+from aws_ndvi_processor import AWSNDVIProcessor, ALL_INDICES
 
 # Configure structured logging
 logging.basicConfig(
@@ -32,12 +32,14 @@ def process():
     Expected request body:
     {
         "bbox": <GeoJSON geometry>,
-        "date_range": "YYYY-MM-DD" or "YYYY-MM-DD,YYYY-MM-DD"
+        "date_range": "YYYY-MM-DD" or "YYYY-MM-DD,YYYY-MM-DD",
+        "indices": ["ndvi", "ndwi", "ndmi", "evi", "savi"] (optional, defaults to all)
     }
     """
     data = request.json
     bbox = data.get('bbox')
     date_range = data.get('date_range')
+    indices = data.get('indices') or ALL_INDICES
     
     if not bbox:
         logger.warning("Missing bbox parameter in request")
@@ -46,14 +48,22 @@ def process():
             "message": "Missing bbox parameter"
         }), 400
     
+    if not isinstance(indices, (list, tuple)) or not all(name in ALL_INDICES for name in indices):
+        logger.warning("Invalid indices parameter in request", extra={"indices": indices})
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid indices parameter, expected a list of: {', '.join(ALL_INDICES)}"
+        }), 400
+    
     logger.info("Received NDVI processing request", extra={
         "bbox_type": type(bbox).__name__,
-        "date_range": date_range
+        "date_range": date_range,
+        "indices": indices
     })
     
     # Process NDVI using the processor
     try:
-        result = processor.process_parcel_ndvi(bbox, date_range)
+        result = processor.process_parcel_ndvi(bbox, date_range, indices)
         
         logger.info("NDVI processing completed successfully", extra={
             "status": result.get('status'),
@@ -9,10 +9,13 @@ This module uses:
 """
 
 import os
-import io
-import base64
+import functools
+import importlib.util
+import math
 import logging
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Configure structured logging
@@ -22,27 +25,191 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-try:
-    import boto3
-    from botocore import UNSIGNED
-    from botocore.config import Config
-    import rasterio
-    from rasterio.session import AWSSession
-    from rasterio.warp import transform_bounds
-    from rasterio.windows import from_bounds
-    from rasterio.features import geometry_mask
-    from rasterio.transform import Affine
-    from shapely.geometry import shape, mapping
-    from shapely.ops import transform as shapely_transform
-    import pystac_client
-    from PIL import Image
-    import pyproj
-    DEPENDENCIES_AVAILABLE = True
-except ImportError as e:
-    DEPENDENCIES_AVAILABLE = False
-    logger.warning(f"Satellite processing dependencies not available: {e}")
+# The geospatial stack (rasterio/GDAL, boto3, pyproj, ...) takes seconds to
+# import, so it is only probed for here and imported where it is used, as are
+# numba and the kernels: loading this module, and answering /health, stays cheap.
+_REQUIRED_MODULES = ('boto3', 'rasterio', 'shapely', 'pystac_client', 'pyproj')
+_missing_modules = [name for name in _REQUIRED_MODULES if importlib.util.find_spec(name) is None]
+DEPENDENCIES_AVAILABLE = not _missing_modules
+if _missing_modules:
+    logger.warning(f"Satellite processing dependencies not available: {', '.join(_missing_modules)}")
     logger.warning("Running in mock mode. Install: boto3, rasterio, pystac-client, shapely, Pillow, pyproj")
 
+# GDAL settings for reading Cloud Optimized GeoTIFFs over HTTP: one ranged GET
+# covering the header and IFDs on open, HTTP/2 multiplexing the block requests,
+# and adjacent block ranges merged into a single request
+GDAL_ENV_OPTIONS = {
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_VERSION': '2',
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_INGESTED_BYTES_AT_OPEN': '32768',
+    'GDAL_NUM_THREADS': 'ALL_CPUS',
+}
+
+# Process-wide GDAL caches, so COG headers and blocks fetched for one request
+# are reused by the next one hitting the same scene (env vars take precedence)
+GDAL_CACHE_DEFAULTS = {
+    'GDAL_CACHEMAX': '512',
+    'CPL_VSIL_CURL_CACHE_SIZE': '200000000',
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': '100000000',
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.TIF,.tiff',
+}
+
+from cache import TTLCache, geojson_digest
+
+# Parcel windows larger than this (pixels per side at 10m) are read decimated
+# from the COG overviews
+MAX_WINDOW_SIZE = int(os.getenv('NDVI_MAX_WINDOW_SIZE', '1024'))
+
+# STAC asset keys of the bands each index is computed from (Sentinel-2 L2A:
+# blue B02, green B03, red B04 and nir B08 at 10m, swir16 B11 at 20m)
+INDEX_BANDS = {
+    'ndvi': ('red', 'nir'),
+    'ndwi': ('green', 'nir'),
+    'ndmi': ('nir', 'swir16'),
+    'evi': ('blue', 'red', 'nir'),
+    'savi': ('red', 'nir'),
+}
+ALL_INDICES = tuple(INDEX_BANDS)
+
+# Indices returned with a colored overlay image
+IMAGE_INDICES = ('ndvi', 'ndwi', 'ndmi', 'evi')
+
+# Overlay colouring and encoding for the four index images of a request run
+# side by side (zlib, libpng and the numba colouring kernel release the GIL)
+_ENCODER_POOL = ThreadPoolExecutor(max_workers=4)
+
+# Fixed fields of the mock mode response (only the product date varies)
+_MOCK_RESULT = {
+    "status": "success",
+    "message": "NDVI processed (MOCK MODE - install dependencies for real processing)",
+    "ndvi_mean": 0.68,
+    "ndvi_std": 0.12,
+    "ndvi_min": 0.35,
+    "ndvi_max": 0.85,
+    "pixels_count": 15000,
+    "cloud_cover": 15.2,
+    "satellite": "Sentinel-2A",
+    "scene_id": "S2A_MSIL2A_20251115T..._MOCK",
+    "data_source": "AWS S3 Open Data (Mock Mode)",
+    "info": "Install boto3, rasterio, pystac-client, and shapely to enable real satellite processing from AWS S3"
+}
+
+# STAC search results keyed by (bbox rounded to 0.001 deg, dates, cloud threshold)
+_STAC_SEARCH_CACHE = TTLCache(maxsize=256, ttl=int(os.getenv('STAC_CACHE_TTL', '3600')))
+
+
+@functools.lru_cache(maxsize=64)
+def _get_transformer(src_crs, dst_crs):
+    """Return a cached always_xy Transformer between two CRS strings (thread-safe once built)."""
+    import pyproj
+    return pyproj.Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+
+def _transform_bounds(src_crs, dst_crs, *bounds):
+    """transform_bounds() through the cached Transformer for (src_crs, dst_crs)."""
+    return _get_transformer(str(src_crs), str(dst_crs)).transform_bounds(*bounds, densify_pts=21)
+
+
+def _nodata_mask(src, data):
+    """Bool mask of the pixels in data equal to the dataset's nodata value."""
+    if src.nodata is None:
+        return np.zeros(data.shape, dtype=bool)
+    return data == src.nodata
+
+
+def _window_grid(src, bounds_wgs84):
+    """
+    Pixel grid of the window of src covering a WGS84 bounding box.
+    
+    The window is snapped outwards to whole pixels, so it covers the whole box.
+    
+    Returns:
+        tuple of (crs, window transform, (height, width))
+    """
+    from rasterio.windows import Window, from_bounds
+    
+    bounds_raster = _transform_bounds('EPSG:4326', src.crs, *bounds_wgs84)
+    window = from_bounds(*bounds_raster, transform=src.transform)
+    col_off, row_off = math.floor(window.col_off), math.floor(window.row_off)
+    width = max(1, math.ceil(window.col_off + window.width) - col_off)
+    height = max(1, math.ceil(window.row_off + window.height) - row_off)
+    window = Window(col_off, row_off, width, height)
+    return src.crs, src.window_transform(window), (height, width)
+
+
+def _decimated_shape(shape, max_size):
+    """Shape of shape reduced by the smallest integer factor fitting both sides in max_size."""
+    factor = math.ceil(max(shape) / max_size)
+    if factor <= 1:
+        return shape
+    return (math.ceil(shape[0] / factor), math.ceil(shape[1] / factor))
+
+
+# Per-thread band read buffer, reused by requests whose window has the same shape
+_band_buffers = threading.local()
+
+
+def _band_buffer(count, shape, dtype):
+    """Return this thread's (count, height, width) band buffer, reallocating it on a shape change."""
+    buffer = getattr(_band_buffers, 'buffer', None)
+    if buffer is None or buffer.shape != (count, *shape) or buffer.dtype != dtype:
+        buffer = np.empty((count, *shape), dtype=dtype)
+        _band_buffers.buffer = buffer
+    return buffer
+
+
+def _read_on_grid(src, crs, transform, shape, out=None):
+    """
+    Read band 1 resampled (nearest neighbour) onto a target grid.
+    
+    A WarpedVRT with the target transform and size makes GDAL fetch only the
+    source blocks under the grid and resample them while decoding, with the
+    output pixels exactly aligned to the target (bands already on the target
+    grid come through unchanged). The band is returned as a plain ndarray with
+    its nodata mask alongside: index arithmetic on np.ma arrays pays a mask
+    update and a wrapper allocation per operation.
+    
+    With out, the band is read into that array in the dataset's dtype instead of
+    a new one. An out array smaller than the grid reads it decimated (average
+    of valid pixels); GDAL serves such reads from the COG's internal overviews
+    instead of fetching every full-resolution block.
+    
+    Returns:
+        tuple of (band data, bool nodata mask)
+    """
+    from rasterio.enums import Resampling
+    from rasterio.vrt import WarpedVRT
+    
+    with WarpedVRT(src, crs=crs, transform=transform, height=shape[0], width=shape[1],
+                   resampling=Resampling.nearest) as vrt:
+        if out is None:
+            data = vrt.read(1)
+        elif out.shape == tuple(shape):
+            data = vrt.read(1, out=out)
+        else:
+            data = vrt.read(1, out=out, resampling=Resampling.average)
+    return data, _nodata_mask(src, data)
+
+
+def _normalize_indices(indices):
+    """Requested index names in ALL_INDICES order; NDVI is always included."""
+    requested = set(indices) | {'ndvi'}
+    return tuple(name for name in ALL_INDICES if name in requested)
+
+
+def _scene_keys(items):
+    """Return (cloud cover, acquisition timestamp) for each STAC item, parsed once."""
+    cloud_covers = [item.properties.get('eo:cloud_cover', 100) for item in items]
+    # Sentinel-2 STAC datetimes are UTC ('...Z'): NumPy parses every
+    # 'YYYY-MM-DDTHH:MM:SS' prefix in one vectorized call
+    timestamps = np.array(
+        [item.properties['datetime'][:19] for item in items], dtype='datetime64[s]'
+    ).astype(np.int64)
+    return list(zip(cloud_covers, timestamps.tolist()))
+
 
 class AWSNDVIProcessor:
     """
@@ -59,22 +226,49 @@ class AWSNDVIProcessor:
         """Initialize processor with AWS S3 access (no credentials needed)."""
         self.mock_mode = not DEPENDENCIES_AVAILABLE
         
+        # Rasterized parcel masks per (geometry, raster grid), see _polygon_masks
+        self._mask_cache = TTLCache(maxsize=128)
+        
+        # Index statistics and overlays per (scene, geometry): a scene never changes,
+        # so re-rendering a parcel on the same scene skips the S3 reads entirely
+        self._result_cache = TTLCache(maxsize=int(os.getenv('NDVI_RESULT_CACHE_SIZE', '64')))
+        
         if not self.mock_mode:
-            # Configure boto3 for unsigned requests (public data)
-            self.s3_client = boto3.client(
-                's3',
-                region_name='eu-central-1',
-                config=Config(signature_version=UNSIGNED)
-            )
+            # Enable GDAL block and HTTP caching before the first dataset is opened
+            for key, value in GDAL_CACHE_DEFAULTS.items():
+                os.environ.setdefault(key, value)
             
             # STAC API endpoint for searching Sentinel-2 catalog
+            # (the S3 client and STAC session are created on first use)
             self.stac_api = "https://earth-search.aws.element84.com/v1"
             print("AWS NDVI Processor initialized - using S3 Open Data")
         else:
             self.s3_client = None
             self.stac_api = None
+            self.stac_io = None
             print("AWS NDVI Processor in MOCK mode")
     
+    @functools.cached_property
+    def s3_client(self):
+        """boto3 S3 client configured for unsigned requests (public data)."""
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.config import Config
+        return boto3.client(
+            's3',
+            region_name='eu-central-1',
+            config=Config(signature_version=UNSIGNED)
+        )
+    
+    @functools.cached_property
+    def stac_io(self):
+        """Shared STAC HTTP session: unchanged responses are revalidated via ETag (304)."""
+        from pystac_client.stac_api_io import StacApiIO
+        from http_cache import ETagCachingAdapter
+        stac_io = StacApiIO()
+        stac_io.session.mount('https://', ETagCachingAdapter(max_retries=5))
+        return stac_io
+    
     def search_sentinel2_stac(self, geojson, start_date, end_date, max_cloud_cover=30):
         """
         Search for Sentinel-2 scenes using STAC API.
@@ -92,13 +286,22 @@ class AWSNDVIProcessor:
             return self._mock_search(geojson, start_date, end_date)
         
         try:
-            # Connect to STAC catalog
-            catalog = pystac_client.Client.open(self.stac_api)
+            import pystac_client
+            from shapely.geometry import shape
             
             # Extract bounding box from GeoJSON
             geom = shape(geojson)
             bbox = list(geom.bounds)  # (minx, miny, maxx, maxy)
             
+            cache_key = (tuple(round(c, 3) for c in bbox), start_date, end_date, max_cloud_cover)
+            cached_items = _STAC_SEARCH_CACHE.get(cache_key)
+            if cached_items is not None:
+                logger.info(f"Using cached STAC search ({len(cached_items)} scenes)", extra={"scene_count": len(cached_items)})
+                return list(cached_items)
+            
+            # Connect to STAC catalog
+            catalog = pystac_client.Client.open(self.stac_api, stac_io=self.stac_io)
+            
             logger.info(f"Searching STAC catalog", extra={
                 "bbox": bbox,
                 "start_date": start_date,
@@ -116,112 +319,213 @@ class AWSNDVIProcessor:
             
             items = list(search.items())
             logger.info(f"Found {len(items)} Sentinel-2 scenes", extra={"scene_count": len(items)})
+            _STAC_SEARCH_CACHE.set(cache_key, tuple(items))
             return items
             
         except Exception as e:
             logger.error(f"Error searching STAC catalog", exc_info=True, extra={"error": str(e)})
             return []
     
-    def generate_ndvi_image(self, ndvi_array):
+    def generate_ndvi_image(self, ndvi_array, upscale_factor=1, polygon_mask=None):
         """
         Generate a colored NDVI image with transparency for masked areas.
         
         Args:
             ndvi_array: numpy masked array of NDVI values (-1 to 1)
+            upscale_factor: integer nearest-neighbour upscale factor for the output
+            polygon_mask: optional bool array at the upscaled shape, True outside the polygon
             
         Returns:
-            base64 encoded PNG image string
+            base64 encoded image data URI (PNG unless OVERLAY_IMAGE_FORMAT=webp), or None on error
         """
-        try:
-            # Create RGBA image (with alpha channel for transparency)
-            height, width = ndvi_array.shape
-            rgba_image = np.zeros((height, width, 4), dtype=np.uint8)
-            
-            # Handle masked array
-            if hasattr(ndvi_array, 'mask'):
-                valid_mask = ~ndvi_array.mask
-                ndvi_data = np.where(valid_mask, ndvi_array.data, np.nan)
-            else:
-                ndvi_data = ndvi_array
-                valid_mask = np.isfinite(ndvi_data)
-            
-            # Color mapping for valid pixels
-            for i in range(height):
-                for j in range(width):
-                    if valid_mask[i, j]:
-                        ndvi_val = ndvi_data[i, j]
-                        
-                        if ndvi_val < 0.3:
-                            # Red to Yellow gradient (stressed to moderate)
-                            ratio = (ndvi_val + 1) / 1.3  # Map [-1, 0.3] to [0, 1]
-                            rgba_image[i, j] = [255, int(255 * ratio), 0, 255]  # Opaque
-                        elif ndvi_val < 0.6:
-                            # Yellow to Green gradient (moderate to healthy)
-                            ratio = (ndvi_val - 0.3) / 0.3  # Map [0.3, 0.6] to [0, 1]
-                            rgba_image[i, j] = [int(255 * (1 - ratio)), 255, 0, 255]  # Opaque
-                        else:
-                            # Green (healthy)
-                            intensity = int(100 + (ndvi_val - 0.6) * 387.5)  # Map [0.6, 1] to [100, 255]
-                            rgba_image[i, j] = [0, min(255, intensity), 0, 255]  # Opaque
-                    else:
-                        # Fully transparent for masked pixels
-                        rgba_image[i, j] = [0, 0, 0, 0]
-            
-            # Create PIL Image with alpha channel
-            pil_image = Image.fromarray(rgba_image, mode='RGBA')
-            
-            # Scale up if image is very small (use NEAREST to preserve colors)
-            if width < 100 or height < 100:
-                scale_factor = max(100 // width, 100 // height, 2)
-                new_size = (width * scale_factor, height * scale_factor)
-                pil_image = pil_image.resize(new_size, Image.NEAREST)
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format='PNG')
-            buffer.seek(0)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            
-            return f"data:image/png;base64,{img_base64}"
+        from image_generator import generate_index_image
+        
+        return generate_index_image(ndvi_array, 'ndvi', upscale_factor, polygon_mask)
+
+    @staticmethod
+    def _spectral_indices_numpy(bands, indices=ALL_INDICES):
+        """
+        NumPy fallback computing the requested indices (used when numba is missing).
+        
+        Indices are computed in float32 on plain arrays (with an epsilon to avoid
+        division by zero); nodata pixels may produce inf/nan and are masked by
+        the caller. Each band is cast once, and NIR - Red / NIR + Red are shared
+        by NDVI, EVI and SAVI.
+        
+        Args:
+            bands: dict of band arrays keyed by STAC asset key, see INDEX_BANDS
+            indices: names of the indices to compute
             
-        except Exception as e:
-            print(f"Error generating NDVI image: {e}")
-            return None
+        Returns:
+            dict of float32 index arrays keyed by index name
+        """
+        eps = np.float32(1e-8)
+        bands_f = {key: band.astype(np.float32) for key, band in bands.items()}
+        red_f, nir_f = bands_f['red'], bands_f['nir']
+        results = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'ndvi' in indices or 'evi' in indices or 'savi' in indices:
+                nir_minus_red = nir_f - red_f
+            if 'ndvi' in indices or 'savi' in indices:
+                nir_plus_red = nir_f + red_f
+            
+            if 'ndvi' in indices:
+                # NDVI = (NIR - Red) / (NIR + Red)
+                results['ndvi'] = nir_minus_red / (nir_plus_red + eps)
+            
+            if 'ndwi' in indices:
+                # NDWI = (Green - NIR) / (Green + NIR)
+                green_f = bands_f['green']
+                results['ndwi'] = (green_f - nir_f) / (green_f + nir_f + eps)
+            
+            if 'ndmi' in indices:
+                # NDMI = (NIR - SWIR) / (NIR + SWIR)
+                swir_f = bands_f['swir16']
+                results['ndmi'] = (nir_f - swir_f) / (nir_f + swir_f + eps)
+            
+            if 'evi' in indices:
+                # EVI = 2.5 * ((NIR - Red) / (NIR + 6*Red - 7.5*Blue + 1))
+                # (constants are float32 so NumPy keeps the float32 result)
+                results['evi'] = np.float32(2.5) * (nir_minus_red /
+                            (nir_f + np.float32(6) * red_f - np.float32(7.5) * bands_f['blue'] + np.float32(1)))
+            
+            if 'savi' in indices:
+                # SAVI = ((NIR - Red) / (NIR + Red + L)) * (1 + L), L=0.5
+                L = np.float32(0.5)
+                results['savi'] = (nir_minus_red / (nir_plus_red + L)) * (1 + L)
+        return results
     
-    def calculate_ndvi_from_s3(self, item, geojson):
+    @staticmethod
+    def _read_band(url, aws_session, grid, out=None):
         """
-        Calculate all indices from Sentinel-2 bands stored on S3 and generate colored overlay images.
+        Read a single-band COG onto the target pixel grid.
+        
+        Safe to run in a worker thread: rasterio environments are thread-local,
+        so the read enters its own Env. GDAL releases the GIL during the HTTP
+        range requests, letting several bands download concurrently. Each read
+        opens its own dataset handle, so concurrent requests on the same scene
+        never wait on each other; the process-wide GDAL caches (see
+        GDAL_CACHE_DEFAULTS) keep reopening a COG from refetching its header.
+        
+        Args:
+            url: band COG URL
+            aws_session: rasterio AWSSession
+            grid: (crs, transform, shape) of the target window, see _window_grid
+            out: optional 2D array of the dataset's dtype to read into; a shape
+                smaller than the grid reads it decimated
+            
+        Returns:
+            tuple of (band data, nodata mask)
+        """
+        import rasterio
+        
+        with rasterio.Env(aws_session, **GDAL_ENV_OPTIONS):
+            with rasterio.open(url) as src:
+                return _read_on_grid(src, *grid, out=out)
+    
+    def _polygon_masks(self, geojson, geom, raster_crs, window_transform, window_shape, upscale_factor):
+        """
+        Rasterize the parcel polygon on the upscaled grid and pool it to the native grid.
+        
+        The polygon is rasterized once; a native pixel is kept in the native
+        mask if any of its sub-pixels lies inside the polygon, so the statistics
+        cover exactly the pixels visible on the overlay. Both masks only depend
+        on the geometry and the raster grid and are cached per (geometry hash,
+        CRS, window transform, shape, upscale factor), so repeated requests for
+        the same parcel and tile reuse them. Cached masks are read-only.
+        
+        Args:
+            geojson: GeoJSON geometry of the parcel
+            geom: shapely geometry of geojson (EPSG:4326)
+            raster_crs: CRS of the band rasters
+            window_transform: affine transform of the native-resolution window
+            window_shape: (height, width) of the native-resolution window
+            upscale_factor: integer upscale factor of the overlay grid
+            
+        Returns:
+            tuple of (low_res_mask, polygon_mask), True outside the polygon
+        """
+        cache_key = (geojson_digest(geojson), str(raster_crs), tuple(window_transform), tuple(window_shape), upscale_factor)
+        masks = self._mask_cache.get(cache_key)
+        if masks is not None:
+            return masks
+        
+        from rasterio.features import geometry_mask
+        from rasterio.transform import Affine
+        from shapely.ops import transform as shapely_transform
+        
+        # Transform the polygon geometry to raster CRS
+        project = _get_transformer('EPSG:4326', str(raster_crs))
+        geom_raster_crs = shapely_transform(project.transform, geom)
+        
+        # Rasterize once, on the upscaled grid only
+        polygon_mask = geometry_mask(
+            [geom_raster_crs],
+            out_shape=(window_shape[0] * upscale_factor, window_shape[1] * upscale_factor),
+            transform=window_transform * Affine.scale(1/upscale_factor, 1/upscale_factor),
+            invert=False
+        )
+        # Native-grid mask: a pixel is outside only if all its sub-pixels are
+        height, width = window_shape
+        low_res_mask = polygon_mask.reshape(height, upscale_factor, width, upscale_factor).all(axis=(1, 3))
+        low_res_mask.flags.writeable = False
+        polygon_mask.flags.writeable = False
+        
+        masks = (low_res_mask, polygon_mask)
+        self._mask_cache.set(cache_key, masks)
+        return masks
+    
+    def calculate_ndvi_from_s3(self, item, geojson, indices=ALL_INDICES):
+        """
+        Calculate indices from Sentinel-2 bands stored on S3 and generate colored overlay images.
+        
+        Only the bands needed by the requested indices are read, and only those
+        indices are computed, colored and encoded. NDVI is always included.
+        Successful results are cached per (scene ID, geometry, indices); failures are not.
         
         Args:
             item: STAC item with band URLs
             geojson: GeoJSON geometry to clip to
+            indices: names of the indices to calculate, see ALL_INDICES
             
         Returns:
-            dict with all index statistics and images
+            dict with the requested index statistics and images
         """
         if self.mock_mode:
             return self._mock_ndvi()
         
+        indices = _normalize_indices(indices)
+        cache_key = (item.id, geojson_digest(geojson), indices)
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            logger.info("Using cached indices", extra={"scene_id": item.id})
+            return dict(cached)
+        
         try:
-            from image_generator import generate_index_image
-            
-            # Get band URLs from STAC item
-            blue_url = item.assets['blue'].href    # Band 2 (10m resolution)
-            green_url = item.assets['green'].href  # Band 3 (10m resolution)
-            red_url = item.assets['red'].href      # Band 4 (10m resolution)
-            nir_url = item.assets['nir'].href      # Band 8 (10m resolution)
-            swir_url = item.assets['swir16'].href  # Band 11 (20m resolution, for NDMI)
+            import boto3
+            import rasterio
+            from rasterio.session import AWSSession
+            from rasterio.transform import Affine
+            from shapely.geometry import shape
+            from image_generator import generate_index_image, overlay_upscale_factor
+            from ndvi_numba import NUMBA_AVAILABLE
+            
+            # Get the URLs of the bands the requested indices need from the STAC item
+            band_urls = {
+                key: item.assets[key].href
+                for key in ('blue', 'green', 'red', 'nir', 'swir16')
+                if any(key in INDEX_BANDS[name] for name in indices)
+            }
             
             print(f"Reading bands from S3...")
-            print(f"BLUE: {blue_url[:80]}...")
-            print(f"GREEN: {green_url[:80]}...")
-            print(f"RED: {red_url[:80]}...")
-            print(f"NIR: {nir_url[:80]}...")
-            print(f"SWIR: {swir_url[:80]}...")
+            for key, url in band_urls.items():
+                print(f"{key.upper()}: {url[:80]}...")
             
-            # Create AWS session for rasterio (unsigned access)
+            # Create AWS session for rasterio (unsigned access: the bucket is public,
+            # so GDAL skips credential lookup and request signing)
             aws_session = AWSSession(
                 boto3.Session(),
+                aws_unsigned=True,
                 requester_pays=False
             )
             
@@ -231,149 +535,132 @@ class AWSNDVIProcessor:
             
             print(f"WGS84 bounds: {bounds_wgs84}")
             
-            with rasterio.Env(aws_session):
-                # Read BLUE band
-                with rasterio.open(blue_url) as blue_src:
-                    print(f"Raster CRS: {blue_src.crs}")
-                    bounds_raster = transform_bounds('EPSG:4326', blue_src.crs, *bounds_wgs84)
-                    window = from_bounds(*bounds_raster, transform=blue_src.transform)
-                    blue = blue_src.read(1, window=window, masked=True)
-                    window_transform = blue_src.window_transform(window)
-                    window_shape = blue.shape
-                    raster_crs = blue_src.crs
-                
-                # Read GREEN band
-                with rasterio.open(green_url) as green_src:
-                    bounds_raster = transform_bounds('EPSG:4326', green_src.crs, *bounds_wgs84)
-                    window = from_bounds(*bounds_raster, transform=green_src.transform)
-                    green = green_src.read(1, window=window, masked=True)
-                
-                # Read RED band
-                with rasterio.open(red_url) as red_src:
-                    bounds_raster = transform_bounds('EPSG:4326', red_src.crs, *bounds_wgs84)
-                    window = from_bounds(*bounds_raster, transform=red_src.transform)
-                    red = red_src.read(1, window=window, masked=True)
-                    print(f"RED band shape: {red.shape}")
-                
-                # Read NIR band
-                with rasterio.open(nir_url) as nir_src:
-                    bounds_raster = transform_bounds('EPSG:4326', nir_src.crs, *bounds_wgs84)
-                    window = from_bounds(*bounds_raster, transform=nir_src.transform)
-                    nir = nir_src.read(1, window=window, masked=True)
-                    print(f"NIR band shape: {nir.shape}")
-                
-                # Read SWIR band (20m resolution - will be resampled)
-                with rasterio.open(swir_url) as swir_src:
-                    bounds_raster = transform_bounds('EPSG:4326', swir_src.crs, *bounds_wgs84)
-                    window = from_bounds(*bounds_raster, transform=swir_src.transform)
-                    swir = swir_src.read(1, window=window, masked=True)
-                    # Resample SWIR to match 10m bands using nearest neighbor
-                    from scipy.ndimage import zoom
-                    scale_factor = (red.shape[0] / swir.shape[0], red.shape[1] / swir.shape[1])
-                    swir = zoom(swir.filled(0), scale_factor, order=0)  # order=0 = nearest neighbor
-                    swir = np.ma.masked_array(swir, mask=red.mask if hasattr(red, 'mask') else False)
-                    print(f"SWIR band resampled to shape: {swir.shape}")
-            
-            # Calculate indices (add epsilon to avoid division by zero)
-            eps = 1e-8
-            
-            # NDVI = (NIR - Red) / (NIR + Red)
-            ndvi = (nir.astype(float) - red.astype(float)) / (nir.astype(float) + red.astype(float) + eps)
-            
-            # NDWI = (Green - NIR) / (Green + NIR)
-            ndwi = (green.astype(float) - nir.astype(float)) / (green.astype(float) + nir.astype(float) + eps)
-            
-            # NDMI = (NIR - SWIR) / (NIR + SWIR)
-            ndmi = (nir.astype(float) - swir.astype(float)) / (nir.astype(float) + swir.astype(float) + eps)
-            
-            # EVI = 2.5 * ((NIR - Red) / (NIR + 6*Red - 7.5*Blue + 1))
-            evi = 2.5 * ((nir.astype(float) - red.astype(float)) / 
-                        (nir.astype(float) + 6 * red.astype(float) - 7.5 * blue.astype(float) + 1))
-            
-            # SAVI = ((NIR - Red) / (NIR + Red + L)) * (1 + L), L=0.5
-            L = 0.5
-            savi = ((nir.astype(float) - red.astype(float)) / 
-                   (nir.astype(float) + red.astype(float) + L)) * (1 + L)
-            
-            # --- UPSAMPLING for all indices ---
-            upscale_factor = int(os.getenv('NDVI_UPSCALE_FACTOR', '3'))
-            
-            # Upsample all index arrays
-            ndvi_high_res = np.repeat(np.repeat(ndvi, upscale_factor, axis=0), upscale_factor, axis=1)
-            ndwi_high_res = np.repeat(np.repeat(ndwi, upscale_factor, axis=0), upscale_factor, axis=1)
-            ndmi_high_res = np.repeat(np.repeat(ndmi, upscale_factor, axis=0), upscale_factor, axis=1)
-            evi_high_res = np.repeat(np.repeat(evi, upscale_factor, axis=0), upscale_factor, axis=1)
+            # Common target grid: the RED window over the parcel. The 10m bands share
+            # RED's CRS and pixel grid, and SWIR (20m) is resampled onto it by GDAL
+            with rasterio.Env(aws_session, **GDAL_ENV_OPTIONS):
+                with rasterio.open(band_urls['red']) as red_src:
+                    grid = _window_grid(red_src, bounds_wgs84)
+                    band_dtype = red_src.dtypes[0]
+            raster_crs, window_transform, window_shape = grid
+            print(f"Raster CRS: {raster_crs}, window shape: {window_shape}")
+            
+            # Large parcels are processed on a decimated grid read from the overviews
+            read_shape = _decimated_shape(window_shape, MAX_WINDOW_SIZE)
+            if read_shape != window_shape:
+                window_transform = window_transform * Affine.scale(
+                    window_shape[1] / read_shape[1], window_shape[0] / read_shape[0]
+                )
+                window_shape = read_shape
+                print(f"Large parcel: reading decimated to {window_shape}")
+            
+            # Fetch the bands concurrently (independent S3 range reads), each into
+            # its slice of one buffer in the native dtype (uint16 reflectance).
+            # The buffer is reused by this thread's next request of the same shape,
+            # so the bands must not outlive this call (only derived arrays do)
+            band_buffer = _band_buffer(len(band_urls), window_shape, band_dtype)
+            bands, band_masks = {}, {}
+            with ThreadPoolExecutor(max_workers=len(band_urls)) as executor:
+                band_futures = {
+                    key: executor.submit(self._read_band, url, aws_session, grid, band_buffer[i])
+                    for i, (key, url) in enumerate(band_urls.items())
+                }
+                for key, future in band_futures.items():
+                    bands[key], band_masks[key] = future.result()
             
+            # Upscaled output grid: index arrays stay at native resolution; only the
+            # polygon mask and the uint8 overlays are produced on the upscaled grid.
+            # Small parcels are enlarged here rather than resized again in PIL
+            upscale_factor = overlay_upscale_factor(window_shape, int(os.getenv('NDVI_UPSCALE_FACTOR', '3')))
             new_transform = window_transform * Affine.scale(1/upscale_factor, 1/upscale_factor)
-            new_shape = ndvi_high_res.shape
-            
-            # Transform the polygon geometry to raster CRS
-            project = pyproj.Transformer.from_crs('EPSG:4326', raster_crs, always_xy=True)
-            geom_raster_crs = shapely_transform(project.transform, geom)
-            
-            # Create mask for high-res arrays
-            polygon_mask = geometry_mask(
-                [geom_raster_crs],
-                out_shape=new_shape,
-                transform=new_transform,
-                invert=False
+            new_shape = (window_shape[0] * upscale_factor, window_shape[1] * upscale_factor)
+            
+            # Polygon masks on the native grid (statistics) and the upscaled grid (overlays)
+            low_res_mask, polygon_mask = self._polygon_masks(
+                geojson, geom, raster_crs, window_transform, window_shape, upscale_factor
             )
             
-            # Apply mask to all high-res arrays
-            if hasattr(ndvi, 'mask'):
-                mask_high_res = np.repeat(np.repeat(ndvi.mask, upscale_factor, axis=0), upscale_factor, axis=1)
-                final_mask = mask_high_res | polygon_mask
+            extra_indices = indices[1:]
+            if NUMBA_AVAILABLE:
+                from ndvi_numba import ndvi_and_stats, spectral_indices
+                
+                # Fused passes with per-pixel float32 casts: NDVI with its in-polygon
+                # statistics, then the other four indices if all were requested
+                ndvi = np.empty(window_shape, dtype=np.float32)
+                ndvi_stats = ndvi_and_stats(
+                    bands['red'], bands['nir'], band_masks['red'], band_masks['nir'], low_res_mask, ndvi
+                )
+                index_arrays = {'ndvi': ndvi}
+                if len(extra_indices) == 4:
+                    ndwi, ndmi, evi, savi = (np.empty(window_shape, dtype=np.float32) for _ in range(4))
+                    spectral_indices(bands['blue'], bands['green'], bands['red'], bands['nir'], bands['swir16'],
+                                     ndwi, ndmi, evi, savi)
+                    index_arrays.update(ndwi=ndwi, ndmi=ndmi, evi=evi, savi=savi)
+                elif extra_indices:
+                    # The fused kernel reads all five bands; a subset is computed in NumPy
+                    index_arrays.update(self._spectral_indices_numpy(bands, extra_indices))
             else:
-                final_mask = polygon_mask
-            
-            ndvi_masked = np.ma.masked_array(ndvi_high_res, mask=final_mask)
-            ndwi_masked = np.ma.masked_array(ndwi_high_res, mask=final_mask)
-            ndmi_masked = np.ma.masked_array(ndmi_high_res, mask=final_mask)
-            evi_masked = np.ma.masked_array(evi_high_res, mask=final_mask)
-            
-            # Generate colored images for all indices
+                index_arrays = self._spectral_indices_numpy(bands, indices)
+                ndvi_stats = None
+            
+            # Attach the band nodata masks once, after the arithmetic
+            for name, arr in index_arrays.items():
+                mask = np.zeros(window_shape, dtype=bool)
+                for key in INDEX_BANDS[name]:
+                    mask |= band_masks[key]
+                index_arrays[name] = np.ma.masked_array(arr, mask=mask)
+            ndvi = index_arrays['ndvi']
+            
+            # Generate colored images for the requested indices, concurrently. They
+            # are collected before the masks below are modified in place
             print("Generating colored overlay images...")
-            ndvi_image = generate_index_image(ndvi_masked, 'ndvi')
-            ndwi_image = generate_index_image(ndwi_masked, 'ndwi')
-            ndmi_image = generate_index_image(ndmi_masked, 'ndmi')
-            evi_image = generate_index_image(evi_masked, 'evi')
+            image_futures = {
+                name: _ENCODER_POOL.submit(generate_index_image, index_arrays[name], name, upscale_factor, polygon_mask)
+                for name in IMAGE_INDICES if name in index_arrays
+            }
+            images = {name: future.result() for name, future in image_futures.items()}
             print("✓ All overlay images generated")
             
-            # Calculate stats on ORIGINAL low-res data for all indices
-            low_res_mask = geometry_mask(
-                [geom_raster_crs],
-                out_shape=window_shape,
-                transform=window_transform,
-                invert=False
-            )
-            
-            # Apply mask to all indices
-            for idx_array in [ndvi, ndwi, ndmi, evi, savi]:
-                if hasattr(idx_array, 'mask'):
-                    idx_array.mask = idx_array.mask | low_res_mask
-                else:
-                    idx_array = np.ma.masked_array(idx_array, mask=low_res_mask)
+            # Restrict the statistics to the parcel: OR the polygon mask into each
+            # index's own mask array in place (every index is a masked array here)
+            for idx_array in index_arrays.values():
+                np.logical_or(idx_array.mask, low_res_mask, out=idx_array.mask)
             
             # Calculate stats for each index
+            def valid_values(arr):
+                # Unmasked, finite values compacted in one selection
+                valid = ~np.ma.getmaskarray(arr)
+                valid &= np.isfinite(arr.data)
+                return arr.data[valid]
+            
             def get_stats(arr):
-                valid = arr[~arr.mask] if hasattr(arr, 'mask') else arr
-                valid = valid[np.isfinite(valid)]
+                valid = valid_values(arr)
                 if valid.size == 0:
                     return None
                 return float(np.mean(valid))
             
-            ndvi_valid = ndvi[~ndvi.mask] if hasattr(ndvi, 'mask') else ndvi
-            ndvi_valid = ndvi_valid[np.isfinite(ndvi_valid)]
+            if ndvi_stats is None:
+                # Reductions run over the compacted values, not the full window
+                ndvi_valid = valid_values(ndvi)
+                if ndvi_valid.size == 0:
+                    ndvi_stats = (0, 0.0, 0.0, 0.0, 0.0)
+                else:
+                    ndvi_stats = (ndvi_valid.size, np.mean(ndvi_valid), np.std(ndvi_valid),
+                                  np.min(ndvi_valid), np.max(ndvi_valid))
+            pixels_count, ndvi_mean, ndvi_std, ndvi_min, ndvi_max = ndvi_stats
 
-            if ndvi_valid.size == 0:
+            if pixels_count == 0:
                 print("No valid NDVI values after masking.")
                 return {
                     "ndvi_mean": 0.0, "ndvi_std": 0.0, "ndvi_min": 0.0, "ndvi_max": 0.0,
                     "pixels_count": 0, "ndvi_image": None, "image_dimensions": "0x0px"
                 }
 
-            img_dims = f"{ndvi_high_res.shape[1]}x{ndvi_high_res.shape[0]}px"
-            print(f"Indices calculated: NDVI={np.mean(ndvi_valid):.3f}, NDWI={get_stats(ndwi):.3f}, NDMI={get_stats(ndmi):.3f}, EVI={get_stats(evi):.3f}")
+            index_means = {name: get_stats(index_arrays[name]) for name in extra_indices}
+            
+            img_dims = f"{new_shape[1]}x{new_shape[0]}px"
+            fmt = lambda value: 'n/a' if value is None else f"{value:.3f}"
+            print(f"Indices calculated: NDVI={ndvi_mean:.3f}"
+                  + "".join(f", {name.upper()}={fmt(value)}" for name, value in index_means.items()))
 
             # Calculate image bounds in WGS84
             minx = new_transform.c
@@ -384,39 +671,41 @@ class AWSNDVIProcessor:
             if minx > maxx: minx, maxx = maxx, minx
             if miny > maxy: miny, maxy = maxy, miny
 
-            img_bounds_wgs84 = transform_bounds(raster_crs, 'EPSG:4326', minx, miny, maxx, maxy)
-            
-            return {
-                "ndvi_mean": float(np.mean(ndvi_valid)),
-                "ndvi_std": float(np.std(ndvi_valid)),
-                "ndvi_min": float(np.min(ndvi_valid)),
-                "ndvi_max": float(np.max(ndvi_valid)),
-                "pixels_count": int(ndvi_valid.size),
-                "ndvi_image": ndvi_image,
+            img_bounds_wgs84 = _transform_bounds(raster_crs, 'EPSG:4326', minx, miny, maxx, maxy)
+            
+            result = {
+                "ndvi_mean": float(ndvi_mean),
+                "ndvi_std": float(ndvi_std),
+                "ndvi_min": float(ndvi_min),
+                "ndvi_max": float(ndvi_max),
+                "pixels_count": int(pixels_count),
+                "ndvi_image": images['ndvi'],
                 "image_dimensions": img_dims,
                 "image_bounds": list(img_bounds_wgs84),
-                # New indices with images
-                "ndwi": get_stats(ndwi),
-                "ndwi_image": ndwi_image,
-                "ndmi": get_stats(ndmi),
-                "ndmi_image": ndmi_image,
-                "evi": get_stats(evi),
-                "evi_image": evi_image,
-                "savi": get_stats(savi),
             }
+            # Other requested indices with their images
+            for name, value in index_means.items():
+                result[name] = value
+                if name in images:
+                    result[f"{name}_image"] = images[name]
+            # Overlay failures are logged and returned as None; don't cache them
+            if all(image is not None for image in images.values()):
+                self._result_cache.set(cache_key, result)
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error calculating indices from S3", exc_info=True, extra={"error": str(e)})
             # Return mock data on error
             return self._mock_ndvi()
     
-    def process_parcel_ndvi(self, geojson, date_range=None):
+    def process_parcel_ndvi(self, geojson, date_range=None, indices=ALL_INDICES):
         """
         Process NDVI for a parcel using AWS S3 data.
         
         Args:
             geojson: GeoJSON geometry of the parcel
             date_range: Date string or range (defaults to last 30 days)
+            indices: names of the indices to calculate (NDVI is always included)
             
         Returns:
             dict with NDVI statistics and metadata
@@ -490,24 +779,18 @@ class AWSNDVIProcessor:
         # Options: "least_cloud" (default), "most_recent", "balanced"
         selection_mode = os.getenv('SCENE_SELECTION_MODE', 'least_cloud')
         
+        # Parse each scene's cloud cover and timestamp once, then select by index
+        scene_keys = _scene_keys(items)
         if selection_mode == 'most_recent':
             # Prioritize most recent, then least cloud
-            best_item = min(items, key=lambda x: (
-                -datetime.fromisoformat(x.properties['datetime'].replace('Z', '+00:00')).timestamp(),
-                x.properties.get('eo:cloud_cover', 100)
-            ))
+            ranking = [(-timestamp, cloud) for cloud, timestamp in scene_keys]
         elif selection_mode == 'balanced':
             # Balanced: moderate cloud cover acceptable if more recent
-            best_item = min(items, key=lambda x: (
-                x.properties.get('eo:cloud_cover', 100) * 0.6 + 
-                (-datetime.fromisoformat(x.properties['datetime'].replace('Z', '+00:00')).timestamp() / 86400 * 0.4)
-            ))
+            ranking = [cloud * 0.6 + (-timestamp / 86400 * 0.4) for cloud, timestamp in scene_keys]
         else:  # Default: "least_cloud"
             # Prioritize least cloud cover, then most recent
-            best_item = min(items, key=lambda x: (
-                x.properties.get('eo:cloud_cover', 100),
-                -datetime.fromisoformat(x.properties['datetime'].replace('Z', '+00:00')).timestamp()
-            ))
+            ranking = [(cloud, -timestamp) for cloud, timestamp in scene_keys]
+        best_item = items[min(range(len(items)), key=ranking.__getitem__)]
         
         selected_scene_info = {
             "selection_mode": selection_mode,
@@ -525,7 +808,7 @@ class AWSNDVIProcessor:
         logger.info("=" * 80)
         
         # Calculate NDVI
-        ndvi_stats = self.calculate_ndvi_from_s3(best_item, geojson)
+        ndvi_stats = self.calculate_ndvi_from_s3(best_item, geojson, indices)
         
         # Build response
         result = {
@@ -564,18 +847,7 @@ class AWSNDVIProcessor:
         """Mock processing for development."""
         print("MOCK MODE: Returning simulated NDVI data")
         return {
-            "status": "success",
-            "message": "NDVI processed (MOCK MODE - install dependencies for real processing)",
-            "ndvi_mean": 0.68,
-            "ndvi_std": 0.12,
-            "ndvi_min": 0.35,
-            "ndvi_max": 0.85,
-            "pixels_count": 15000,
+            **_MOCK_RESULT,
             "product_date": (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),
-            "cloud_cover": 15.2,
-            "satellite": "Sentinel-2A",
-            "scene_id": "S2A_MSIL2A_20251115T..._MOCK",
-            "data_source": "AWS S3 Open Data (Mock Mode)",
-            "info": "Install boto3, rasterio, pystac-client, and shapely to enable real satellite processing from AWS S3"
         }
 
@@ -0,0 +1,56 @@
+"""
+Small in-process caches shared by the satellite worker.
+
+The worker runs as a long-lived process serving many parcels, often on the
+same Sentinel-2 scenes, so search and processing results are worth keeping
+around for a while. Everything here is thread-safe and bounded.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a fixed lifetime.
+
+    Args:
+        maxsize: maximum number of entries (least recently used is evicted first)
+        ttl: entry lifetime in seconds, or None to keep entries until evicted
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the live value for key (refreshing its LRU position) or default."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value under key, replacing any previous entry."""
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def geojson_digest(geojson):
+    """Short stable digest of a GeoJSON geometry, for cache keys."""
+    return hashlib.blake2b(json.dumps(geojson, sort_keys=True).encode(), digest_size=8).digest()
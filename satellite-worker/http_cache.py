@@ -0,0 +1,66 @@
+"""
+ETag-based conditional request caching for the STAC API client.
+
+pystac-client sends every search through a requests.Session. Mounting
+ETagCachingAdapter on that session makes repeated identical requests
+(landing page, conformance, search pages) revalidate with If-None-Match, so
+an unchanged catalog answers 304 with no body. The cached body is then
+replayed as a normal 200 response.
+"""
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from cache import TTLCache
+
+
+class ETagCachingAdapter(HTTPAdapter):
+    """
+    HTTP adapter that revalidates responses carrying an ETag.
+
+    The last 200 response for each (method, URL, body) is kept with its ETag.
+    The canonical POST body is part of the key, so every distinct STAC search
+    has its own entry.
+
+    Args:
+        maxsize: maximum number of cached responses
+        **kwargs: forwarded to HTTPAdapter (e.g. max_retries)
+    """
+
+    def __init__(self, maxsize=512, **kwargs):
+        super().__init__(**kwargs)
+        self._responses = TTLCache(maxsize=maxsize)
+
+    def send(self, request, **kwargs):
+        key = (request.method, request.url, request.body)
+        cached = self._responses.get(key)
+        if cached is not None:
+            request.headers['If-None-Match'] = cached[0]
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            return self._replay(cached, request, response)
+
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and etag:
+            self._responses.set(key, (etag, response.content, dict(response.headers)))
+        return response
+
+    @staticmethod
+    def _replay(cached, request, not_modified):
+        """Build a 200 response from the cached body for a 304 reply."""
+        _, content, headers = cached
+        replayed = Response()
+        replayed.status_code = 200
+        replayed.reason = 'OK'
+        replayed._content = content
+        replayed.headers = CaseInsensitiveDict(headers)
+        replayed.url = not_modified.url
+        replayed.request = request
+        replayed.connection = not_modified.connection
+        replayed.elapsed = not_modified.elapsed
+        replayed.encoding = get_encoding_from_headers(replayed.headers)
+        return replayed
@@ -3,135 +3,310 @@ Helper functions for generating colored overlay images for satellite indices.
 """
 import numpy as np
 import io
+import os
 import base64
+import functools
 from PIL import Image
 
+from ndvi_numba import NUMBA_AVAILABLE
+if NUMBA_AVAILABLE:
+    from ndvi_numba import ndvi_to_rgba
 
-def generate_index_image(index_array, index_type='ndvi'):
+try:
+    import imagecodecs
+    IMAGECODECS_AVAILABLE = True
+except ImportError:
+    IMAGECODECS_AVAILABLE = False
+
+# Overlays smaller than this (in either dimension) are enlarged for display
+MIN_IMAGE_SIZE = 100
+
+# Overlay encoding: 'png' (lossless, default) or 'webp' (lossy with alpha,
+# several times smaller for large overlays)
+OVERLAY_IMAGE_FORMAT = os.getenv('OVERLAY_IMAGE_FORMAT', 'png').lower()
+WEBP_QUALITY = int(os.getenv('OVERLAY_WEBP_QUALITY', '85'))
+
+
+def generate_index_image(index_array, index_type='ndvi', upscale_factor=1, polygon_mask=None):
     """
     Generate a colored image for any satellite index with transparency for masked areas.
     
+    Colors are computed at the native index resolution; the uint8 RGBA result is
+    then upscaled and clipped to the polygon, so no upsampled float copy of the
+    index is needed. With numba, vegetation indices are colored, upscaled and
+    clipped in a single parallel pass instead.
+    
     Args:
         index_array: numpy masked array of index values
-        index_type: type of index ('ndvi', 'ndwi', 'ndmi', 'evi')
+        index_type: type of index ('ndvi', 'evi', 'savi', 'ndwi' or 'ndmi')
+        upscale_factor: integer nearest-neighbour upscale factor for the output
+        polygon_mask: optional bool array at the upscaled shape, True outside the polygon
         
     Returns:
-        base64 encoded PNG image string
+        base64 encoded image data URI (PNG unless OVERLAY_IMAGE_FORMAT=webp)
     """
     try:
-        # Create RGBA image (with alpha channel for transparency)
         height, width = index_array.shape
-        rgba_image = np.zeros((height, width, 4), dtype=np.uint8)
         
-        # Handle masked array
-        if hasattr(index_array, 'mask'):
-            valid_mask = ~index_array.mask
-            index_data = np.where(valid_mask, index_array.data, np.nan)
-        else:
-            index_data = index_array
-            valid_mask = np.isfinite(index_data)
+        # Masked and plain arrays take the same path: unmasked, finite pixels are valid
+        index_data = np.ma.getdata(index_array)
+        valid_mask = ~np.ma.getmaskarray(index_array)
+        valid_mask &= np.isfinite(index_data)
         
-        # Color mapping based on index type
-        for i in range(height):
-            for j in range(width):
-                if valid_mask[i, j]:
-                    val = index_data[i, j]
-                    
-                    if index_type == 'ndvi' or index_type == 'evi' or index_type == 'savi':
-                        # Vegetation indices: Red -> Yellow -> Green
-                        rgba_image[i, j] = _vegetation_color(val)
-                    elif index_type == 'ndwi':
-                        # Water index: Red -> Yellow -> Cyan -> Blue
-                        rgba_image[i, j] = _water_color(val)
-                    elif index_type == 'ndmi':
-                        # Moisture index: Brown -> Yellow -> Green -> Blue
-                        rgba_image[i, j] = _moisture_color(val)
-                else:
-                    # Fully transparent for masked pixels
-                    rgba_image[i, j] = [0, 0, 0, 0]
+        if not valid_mask.any():
+            # Fully masked (e.g. clouds over the whole parcel): nothing to color
+            return _transparent_overlay(height * upscale_factor, width * upscale_factor)
         
-        # Create PIL Image with alpha channel
-        pil_image = Image.fromarray(rgba_image, mode='RGBA')
+        color_fn = _COLOR_FUNCS[index_type]
+        if color_fn is vegetation_rgba and NUMBA_AVAILABLE:
+            # Fused kernel writing straight at output resolution
+            height, width = height * upscale_factor, width * upscale_factor
+            if polygon_mask is None:
+                polygon_mask = np.zeros((height, width), dtype=bool)
+            rgba_image = np.zeros((height, width, 4), dtype=np.uint8)
+            ndvi_to_rgba(index_data, valid_mask, polygon_mask, upscale_factor, rgba_image)
+            return encode_overlay(rgba_image)
         
-        # Scale up if image is very small (use NEAREST to preserve colors)
-        if width < 100 or height < 100:
-            scale_factor = max(100 // width, 100 // height, 2)
-            new_size = (width * scale_factor, height * scale_factor)
-            pil_image = pil_image.resize(new_size, Image.NEAREST)
+        # Create RGBA image (with alpha channel for transparency)
+        rgba_image = np.zeros((height, width, 4), dtype=np.uint8)
         
-        # Convert to base64
-        buffer = io.BytesIO()
-        pil_image.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+        # Color mapping based on index type (masked pixels stay fully transparent)
+        color_fn(index_data, valid_mask, rgba_image)
         
-        return f"data:image/png;base64,{img_base64}"
+        rgba_image = upscale_rgba(rgba_image, upscale_factor, polygon_mask)
+        
+        return encode_overlay(rgba_image)
         
     except Exception as e:
         print(f"Error generating {index_type} image: {e}")
         return None
 
 
-def _vegetation_color(val):
+def encode_overlay(rgba_image):
     """
-    Color mapping for vegetation indices (NDVI, EVI, SAVI).
-    Red (stressed) -> Yellow (moderate) -> Green (healthy)
+    Encode an RGBA overlay as a base64 data URI (PNG, or WebP if configured).
+    
+    Images smaller than MIN_IMAGE_SIZE are enlarged with a nearest-neighbour
+    integer upscale first. PNGs are handed straight to libpng through
+    imagecodecs when available (no intermediate PIL image); otherwise Pillow
+    is used. Both encode with zlib level 1. WebP is encoded by Pillow at
+    WEBP_QUALITY.
+    
+    Args:
+        rgba_image: (H, W, 4) uint8 array
+        
+    Returns:
+        "data:image/png;base64,..." or "data:image/webp;base64,..." string
     """
-    if val < 0.3:
-        # Red to Yellow gradient (stressed to moderate)
-        ratio = (val + 1) / 1.3  # Map [-1, 0.3] to [0, 1]
-        return [255, int(255 * ratio), 0, 255]  # Opaque
-    elif val < 0.6:
-        # Yellow to Green gradient (moderate to healthy)
-        ratio = (val - 0.3) / 0.3  # Map [0.3, 0.6] to [0, 1]
-        return [int(255 * (1 - ratio)), 255, 0, 255]  # Opaque
+    height, width = rgba_image.shape[:2]
+    
+    # Scale up if image is very small (nearest neighbour preserves colors)
+    if width < MIN_IMAGE_SIZE or height < MIN_IMAGE_SIZE:
+        scale_factor = max(MIN_IMAGE_SIZE // width, MIN_IMAGE_SIZE // height, 2)
+        rgba_image = upscale_rgba(rgba_image, scale_factor)
+    
+    if OVERLAY_IMAGE_FORMAT == 'webp':
+        mime_type = 'image/webp'
+        buffer = io.BytesIO()
+        Image.fromarray(rgba_image, mode='RGBA').save(buffer, format='WEBP', quality=WEBP_QUALITY)
+        image_bytes = buffer.getbuffer()
+    elif IMAGECODECS_AVAILABLE:
+        mime_type = 'image/png'
+        image_bytes = imagecodecs.png_encode(np.ascontiguousarray(rgba_image), level=1)
     else:
-        # Green (healthy)
-        intensity = int(100 + (val - 0.6) * 387.5)  # Map [0.6, 1] to [100, 255]
-        return [0, min(255, intensity), 0, 255]  # Opaque
+        mime_type = 'image/png'
+        buffer = io.BytesIO()
+        Image.fromarray(rgba_image, mode='RGBA').save(buffer, format='PNG', compress_level=1, optimize=False)
+        # Encode from a view of the buffer instead of copying it out with getvalue()
+        image_bytes = buffer.getbuffer()
+    
+    # base64 output is pure ASCII, which decodes faster than UTF-8
+    img_base64 = base64.b64encode(image_bytes).decode('ascii')
+    return f"data:{mime_type};base64,{img_base64}"
+
 
+@functools.lru_cache(maxsize=32)
+def _transparent_overlay(height, width):
+    """Encoded fully transparent overlay of the given size (cached per size)."""
+    return encode_overlay(np.zeros((height, width, 4), dtype=np.uint8))
 
-def _water_color(val):
+
+def overlay_upscale_factor(shape, upscale_factor):
     """
-    Color mapping for NDWI (water stress index).
-    Red (severe stress) -> Yellow (moderate) -> Cyan (good) -> Blue (excellent)
+    Combine the configured upscale factor with the small-image enlargement.
+    
+    Choosing the final integer factor up front lets the polygon mask be
+    rasterized once at display resolution, instead of upscaling the overlay
+    and then resizing it again in PIL.
+    
+    Args:
+        shape: (height, width) of the native-resolution index array
+        upscale_factor: configured integer upscale factor
+        
+    Returns:
+        integer factor such that both output dimensions reach MIN_IMAGE_SIZE
     """
-    if val < 0.0:
-        # Red to Yellow (severe to moderate stress)
-        ratio = (val + 1) / 1.0  # Map [-1, 0] to [0, 1]
-        return [255, int(255 * ratio), 0, 255]
-    elif val < 0.2:
-        # Yellow to Cyan (moderate to good)
-        ratio = val / 0.2  # Map [0, 0.2] to [0, 1]
-        return [int(255 * (1 - ratio)), 255, int(255 * ratio), 255]
-    elif val < 0.4:
-        # Cyan to Blue (good to excellent)
-        ratio = (val - 0.2) / 0.2  # Map [0.2, 0.4] to [0, 1]
-        return [0, int(255 * (1 - ratio)), 255, 255]
-    else:
-        # Deep blue (excellent water content)
-        intensity = max(100, int(255 * (1 - (val - 0.4) / 0.6)))
-        return [0, 0, min(255, intensity + 50), 255]
+    height, width = shape[0] * upscale_factor, shape[1] * upscale_factor
+    if height >= MIN_IMAGE_SIZE and width >= MIN_IMAGE_SIZE:
+        return upscale_factor
+    scale_factor = max(-(-MIN_IMAGE_SIZE // height), -(-MIN_IMAGE_SIZE // width))
+    return upscale_factor * scale_factor
 
 
-def _moisture_color(val):
+def vegetation_rgba(index_data, valid_mask, rgba_image):
     """
-    Color mapping for NDMI (moisture index).
-    Brown (dry) -> Yellow (moderate) -> Green (good) -> Blue (wet)
+    Color vegetation index values (NDVI, EVI, SAVI) into an RGBA image, vectorized.
+    
+    Red (stressed) -> Yellow (moderate) -> Green (healthy). Pixels outside
+    valid_mask are left transparent (callers pass a zeroed buffer).
+    
+    Args:
+        index_data: 2D float array of index values
+        valid_mask: 2D bool array, True where data is valid and finite
+        rgba_image: (H, W, 4) uint8 array written in place
     """
-    if val < 0.0:
-        # Brown to Yellow (dry to moderate)
-        ratio = (val + 1) / 1.0  # Map [-1, 0] to [0, 1]
-        return [165 + int(90 * ratio), int(100 + 155 * ratio), 42, 255]  # Brown to Yellow
-    elif val < 0.3:
-        # Yellow to Green (moderate to good)
-        ratio = val / 0.3  # Map [0, 0.3] to [0, 1]
-        return [int(255 * (1 - ratio)), 255, int(128 * ratio), 255]
-    elif val < 0.5:
-        # Green to Teal (good to very good)
-        ratio = (val - 0.3) / 0.2  # Map [0.3, 0.5] to [0, 1]
-        return [0, 255, int(128 + 127 * ratio), 255]
-    else:
-        # Teal to Blue (very good to saturated)
-        ratio = (val - 0.5) / 0.5  # Map [0.5, 1.0] to [0, 1]
-        return [0, int(255 * (1 - ratio)), 255, 255]
+    red, green, alpha = rgba_image[..., 0], rgba_image[..., 1], rgba_image[..., 3]
+    low = valid_mask & (index_data < 0.3)
+    mid = valid_mask & (index_data >= 0.3) & (index_data < 0.6)
+    high = valid_mask & (index_data >= 0.6)
+    
+    # Red to Yellow gradient (stressed to moderate)
+    ratio = np.clip((index_data[low] + 1) / 1.3, 0, 1)  # Map [-1, 0.3] to [0, 1]
+    red[low] = 255
+    green[low] = (255 * ratio).astype(np.uint8)
+    
+    # Yellow to Green gradient (moderate to healthy)
+    ratio = (index_data[mid] - 0.3) / 0.3  # Map [0.3, 0.6] to [0, 1]
+    red[mid] = (255 * (1 - ratio)).astype(np.uint8)
+    green[mid] = 255
+    
+    # Green (healthy)
+    intensity = 100 + (index_data[high] - 0.6) * 387.5  # Map [0.6, 1] to [100, 255]
+    green[high] = np.clip(intensity, 0, 255).astype(np.uint8)
+    
+    # Opaque wherever valid: the color bands above cover every finite value
+    np.multiply(valid_mask, np.uint8(255), out=alpha)
+
+
+def upscale_rgba(rgba_image, upscale_factor, polygon_mask=None):
+    """
+    Nearest-neighbour upscale an RGBA image and clear pixels outside the polygon.
+    
+    Args:
+        rgba_image: (H, W, 4) uint8 array
+        upscale_factor: integer upscale factor k
+        polygon_mask: optional bool array of shape (H*k, W*k), True outside the polygon
+        
+    Returns:
+        (H*k, W*k, 4) uint8 array
+    """
+    if upscale_factor > 1:
+        height, width, channels = rgba_image.shape
+        rgba_image = np.broadcast_to(
+            rgba_image[:, None, :, None, :],
+            (height, upscale_factor, width, upscale_factor, channels)
+        ).reshape(height * upscale_factor, width * upscale_factor, channels)
+    
+    if polygon_mask is not None:
+        rgba_image[polygon_mask] = 0
+    
+    return rgba_image
+
+
+def water_rgba(index_data, valid_mask, rgba_image):
+    """
+    Color NDWI (water stress index) values into an RGBA image, vectorized.
+    
+    Red (severe stress) -> Yellow (moderate) -> Cyan (good) -> Blue (excellent).
+    Pixels outside valid_mask are left transparent (callers pass a zeroed buffer).
+    
+    Args:
+        index_data: 2D float array of index values
+        valid_mask: 2D bool array, True where data is valid and finite
+        rgba_image: (H, W, 4) uint8 array written in place
+    """
+    red, green, blue, alpha = (rgba_image[..., c] for c in range(4))
+    severe = valid_mask & (index_data < 0.0)
+    moderate = valid_mask & (index_data >= 0.0) & (index_data < 0.2)
+    good = valid_mask & (index_data >= 0.2) & (index_data < 0.4)
+    excellent = valid_mask & (index_data >= 0.4)
+    
+    # Red to Yellow (severe to moderate stress)
+    ratio = np.clip(index_data[severe] + 1, 0, 1)  # Map [-1, 0] to [0, 1]
+    red[severe] = 255
+    green[severe] = (255 * ratio).astype(np.uint8)
+    
+    # Yellow to Cyan (moderate to good)
+    ratio = index_data[moderate] / 0.2  # Map [0, 0.2] to [0, 1]
+    red[moderate] = (255 * (1 - ratio)).astype(np.uint8)
+    green[moderate] = 255
+    blue[moderate] = (255 * ratio).astype(np.uint8)
+    
+    # Cyan to Blue (good to excellent)
+    ratio = (index_data[good] - 0.2) / 0.2  # Map [0.2, 0.4] to [0, 1]
+    green[good] = (255 * (1 - ratio)).astype(np.uint8)
+    blue[good] = 255
+    
+    # Deep blue (excellent water content)
+    intensity = np.maximum(np.trunc(255 * (1 - (index_data[excellent] - 0.4) / 0.6)), 100)
+    blue[excellent] = np.minimum(intensity + 50, 255).astype(np.uint8)
+    
+    # Opaque wherever valid: the color bands above cover every finite value
+    np.multiply(valid_mask, np.uint8(255), out=alpha)
+
+
+def moisture_rgba(index_data, valid_mask, rgba_image):
+    """
+    Color NDMI (moisture index) values into an RGBA image, vectorized.
+    
+    Brown (dry) -> Yellow (moderate) -> Green (good) -> Blue (wet).
+    Pixels outside valid_mask are left transparent (callers pass a zeroed buffer).
+    
+    Args:
+        index_data: 2D float array of index values
+        valid_mask: 2D bool array, True where data is valid and finite
+        rgba_image: (H, W, 4) uint8 array written in place
+    """
+    red, green, blue, alpha = (rgba_image[..., c] for c in range(4))
+    dry = valid_mask & (index_data < 0.0)
+    moderate = valid_mask & (index_data >= 0.0) & (index_data < 0.3)
+    good = valid_mask & (index_data >= 0.3) & (index_data < 0.5)
+    wet = valid_mask & (index_data >= 0.5)
+    
+    # Brown to Yellow (dry to moderate)
+    ratio = np.clip(index_data[dry] + 1, 0, 1)  # Map [-1, 0] to [0, 1]
+    red[dry] = 165 + (90 * ratio).astype(np.uint8)
+    green[dry] = (100 + 155 * ratio).astype(np.uint8)
+    blue[dry] = 42
+    
+    # Yellow to Green (moderate to good)
+    ratio = index_data[moderate] / 0.3  # Map [0, 0.3] to [0, 1]
+    red[moderate] = (255 * (1 - ratio)).astype(np.uint8)
+    green[moderate] = 255
+    blue[moderate] = (128 * ratio).astype(np.uint8)
+    
+    # Green to Teal (good to very good)
+    ratio = (index_data[good] - 0.3) / 0.2  # Map [0.3, 0.5] to [0, 1]
+    green[good] = 255
+    blue[good] = (128 + 127 * ratio).astype(np.uint8)
+    
+    # Teal to Blue (very good to saturated)
+    ratio = np.clip((index_data[wet] - 0.5) / 0.5, 0, 1)  # Map [0.5, 1.0] to [0, 1]
+    green[wet] = (255 * (1 - ratio)).astype(np.uint8)
+    blue[wet] = 255
+    
+    # Opaque wherever valid: the color bands above cover every finite value
+    np.multiply(valid_mask, np.uint8(255), out=alpha)
+
+
+# Colormap per index type:
+# - vegetation indices: Red -> Yellow -> Green
+# - water index: Red -> Yellow -> Cyan -> Blue
+# - moisture index: Brown -> Yellow -> Green -> Blue
+_COLOR_FUNCS = {
+    'ndvi': vegetation_rgba,
+    'evi': vegetation_rgba,
+    'savi': vegetation_rgba,
+    'ndwi': water_rgba,
+    'ndmi': moisture_rgba,
+}
@@ -0,0 +1,284 @@
+"""
+Numba-compiled kernels for the satellite worker hot paths.
+
+Kernels are compiled on first use and cached on disk (cache=True), so a
+restarted worker does not pay the JIT cost again. Callers check
+NUMBA_AVAILABLE and keep a NumPy fallback for environments without numba.
+"""
+
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Parallel kernels are launched from several request and overlay threads at
+# once, which numba's default workqueue threading layer cannot do (it aborts
+# the process); 'threadsafe' selects TBB or OpenMP instead.
+os.environ.setdefault('NUMBA_THREADING_LAYER', 'threadsafe')
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError as e:
+    NUMBA_AVAILABLE = False
+    logger.warning(f"Numba not available, falling back to NumPy kernels: {e}")
+
+# fastmath without the no-NaN/no-Inf assumptions: invalid values must still
+# fall through the comparisons below instead of producing garbage colours.
+FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(parallel=True, nogil=True, cache=True, fastmath=FASTMATH)
+    def ndvi_to_rgba(ndvi_data, valid_mask, polygon_mask, upscale_factor, out_rgba):
+        """
+        Colour NDVI (or EVI/SAVI) values into a pre-allocated RGBA image in a single pass.
+
+        Red (stressed) -> Yellow (moderate) -> Green (healthy). The output may be
+        an integer upscale of the NDVI grid: each output pixel samples
+        ndvi_data[i // k, j // k], so no upsampled float array is ever built.
+        Pixels that are masked, outside the polygon or not finite are left
+        untouched (callers pass a zeroed buffer).
+
+        Args:
+            ndvi_data: 2D float array of NDVI values (-1 to 1), native resolution
+            valid_mask: 2D bool array matching ndvi_data, True where data is valid
+            polygon_mask: 2D bool array matching out_rgba, True outside the parcel
+            upscale_factor: integer nearest-neighbour upscale factor k
+            out_rgba: (H*k, W*k, 4) uint8 array written in place
+        """
+        height, width = polygon_mask.shape
+        for i in prange(height):
+            si = i // upscale_factor
+            for j in range(width):
+                sj = j // upscale_factor
+                if polygon_mask[i, j] or not valid_mask[si, sj]:
+                    continue
+                v = ndvi_data[si, sj]
+                if v < 0.3:
+                    # Map [-1, 0.3] to [0, 1]
+                    ratio = min(max((v + 1) / 1.3, 0.0), 1.0)
+                    out_rgba[i, j, 0] = 255
+                    out_rgba[i, j, 1] = int(255 * ratio)
+                    out_rgba[i, j, 2] = 0
+                elif v < 0.6:
+                    # Map [0.3, 0.6] to [0, 1]
+                    ratio = (v - 0.3) / 0.3
+                    out_rgba[i, j, 0] = int(255 * (1 - ratio))
+                    out_rgba[i, j, 1] = 255
+                    out_rgba[i, j, 2] = 0
+                elif v >= 0.6:
+                    # Map [0.6, 1] to [100, 255]
+                    intensity = min(max(100 + (v - 0.6) * 387.5, 0.0), 255.0)
+                    out_rgba[i, j, 0] = 0
+                    out_rgba[i, j, 1] = int(intensity)
+                    out_rgba[i, j, 2] = 0
+                else:
+                    # NaN: keep transparent
+                    continue
+                out_rgba[i, j, 3] = 255
+
+    @njit(cache=True, fastmath=FASTMATH)
+    def _ndvi_row(red, nir, red_mask, nir_mask, poly_mask, out_ndvi, i):
+        """Compute one NDVI row and return its (sum, sum_sq, min, max, count)."""
+        eps = np.float32(1e-8)
+        s = 0.0
+        s2 = 0.0
+        mn = np.inf
+        mx = -np.inf
+        n = 0
+        for j in range(red.shape[1]):
+            r = np.float32(red[i, j])
+            ni = np.float32(nir[i, j])
+            v = (ni - r) / (ni + r + eps)
+            out_ndvi[i, j] = v
+            if red_mask[i, j] or nir_mask[i, j] or poly_mask[i, j] or not np.isfinite(v):
+                continue
+            s += v
+            s2 += v * v
+            mn = min(mn, v)
+            mx = max(mx, v)
+            n += 1
+        return s, s2, mn, mx, n
+
+    @njit(parallel=True, cache=True, fastmath=FASTMATH)
+    def ndvi_and_stats(red, nir, red_mask, nir_mask, poly_mask, out_ndvi):
+        """
+        Compute NDVI and its statistics over valid in-polygon pixels in one pass.
+
+        Bands are cast to float32 per pixel, so no float copies of the bands are
+        allocated. Sums are accumulated per row in float64 and reduced at the end.
+
+        Args:
+            red: 2D array of red band values (Band 4), typically uint16
+            nir: 2D array of NIR band values (Band 8), typically uint16
+            red_mask: 2D bool array, True where the red band is nodata
+            nir_mask: 2D bool array, True where the NIR band is nodata
+            poly_mask: 2D bool array, True outside the parcel polygon
+            out_ndvi: 2D float32 array receiving NDVI for every pixel
+
+        Returns:
+            (count, mean, std, min, max) over pixels that are valid, inside
+            the polygon and finite; all zeros if there are none
+        """
+        height = red.shape[0]
+        row_sum = np.zeros(height)
+        row_sum_sq = np.zeros(height)
+        row_min = np.full(height, np.inf)
+        row_max = np.full(height, -np.inf)
+        row_count = np.zeros(height, dtype=np.int64)
+
+        for i in prange(height):
+            row_sum[i], row_sum_sq[i], row_min[i], row_max[i], row_count[i] = _ndvi_row(
+                red, nir, red_mask, nir_mask, poly_mask, out_ndvi, i
+            )
+
+        count = row_count.sum()
+        if count == 0:
+            return 0, 0.0, 0.0, 0.0, 0.0
+        mean = row_sum.sum() / count
+        var = max(row_sum_sq.sum() / count - mean * mean, 0.0)
+        return count, mean, np.sqrt(var), row_min.min(), row_max.max()
+
+    @njit(parallel=True, cache=True, fastmath=FASTMATH, error_model='numpy')
+    def spectral_indices(blue, green, red, nir, swir, out_ndwi, out_ndmi, out_evi, out_savi):
+        """
+        Compute NDWI, NDMI, EVI and SAVI in one pass over the band arrays.
+
+        Each pixel's bands are read once and cast to float32 in registers, so no
+        float copies of the bands or per-formula temporaries are allocated.
+        Division by zero yields inf/nan like NumPy (callers mask nodata).
+
+        Args:
+            blue, green, red, nir, swir: 2D band arrays of the same shape, typically uint16
+            out_ndwi, out_ndmi, out_evi, out_savi: 2D float32 arrays written in place
+        """
+        eps = np.float32(1e-8)
+        L = np.float32(0.5)
+        for i in prange(red.shape[0]):
+            for j in range(red.shape[1]):
+                b = np.float32(blue[i, j])
+                g = np.float32(green[i, j])
+                r = np.float32(red[i, j])
+                n = np.float32(nir[i, j])
+                s = np.float32(swir[i, j])
+                # NDWI = (Green - NIR) / (Green + NIR)
+                out_ndwi[i, j] = (g - n) / (g + n + eps)
+                # NDMI = (NIR - SWIR) / (NIR + SWIR)
+                out_ndmi[i, j] = (n - s) / (n + s + eps)
+                # EVI = 2.5 * ((NIR - Red) / (NIR + 6*Red - 7.5*Blue + 1))
+                out_evi[i, j] = np.float32(2.5) * ((n - r) / (n + np.float32(6) * r - np.float32(7.5) * b + np.float32(1)))
+                # SAVI = ((NIR - Red) / (NIR + Red + L)) * (1 + L), L=0.5
+                out_savi[i, j] = ((n - r) / (n + r + L)) * (1 + L)
+
+    @njit(parallel=True, nogil=True, cache=True, fastmath=FASTMATH)
+    def evi_index(blue, red, nir, out):
+        """
+        EVI = 2.5 * ((NIR - Red) / (NIR + 6*Red - 7.5*Blue + 1)) in one pass, 0 where the denominator is 0.
+
+        Args:
+            blue, red, nir: 1D band arrays of the same length (raveled rasters)
+            out: 1D float32 array written in place
+        """
+        for i in prange(out.shape[0]):
+            b = np.float32(blue[i])
+            r = np.float32(red[i])
+            n = np.float32(nir[i])
+            d = n + np.float32(6) * r - np.float32(7.5) * b + np.float32(1)
+            out[i] = np.float32(2.5) * (n - r) / d if d != 0 else np.float32(0)
+
+    @njit(parallel=True, nogil=True, cache=True, fastmath=FASTMATH)
+    def savi_index(red, nir, L, out):
+        """
+        SAVI = ((NIR - Red) / (NIR + Red + L)) * (1 + L) in one pass, 0 where the denominator is 0.
+
+        Args:
+            red, nir: 1D band arrays of the same length (raveled rasters)
+            L: soil brightness correction factor
+            out: 1D float32 array written in place
+        """
+        soil = np.float32(L)
+        for i in prange(out.shape[0]):
+            r = np.float32(red[i])
+            n = np.float32(nir[i])
+            d = n + r + soil
+            out[i] = (n - r) / d * (1 + soil) if d != 0 else np.float32(0)
+
+    @njit(parallel=True, nogil=True, cache=True, fastmath=FASTMATH)
+    def normalized_difference_index(a, b, out):
+        """
+        (A - B) / (A + B) in one pass (NDVI, NDWI, NDMI), 0 where the denominator is 0.
+
+        Args:
+            a, b: 1D band arrays of the same length (raveled rasters)
+            out: 1D float32 array written in place
+        """
+        for i in prange(out.shape[0]):
+            x = np.float32(a[i])
+            y = np.float32(b[i])
+            d = x + y
+            out[i] = (x - y) / d if d != 0 else np.float32(0)
+
+    @njit(parallel=True, nogil=True, cache=True, fastmath=FASTMATH)
+    def all_indices(blue, green, red, nir, swir, L, out):
+        """
+        NDVI, NDWI, NDMI, EVI and SAVI in one pass, 0 where a denominator is 0.
+
+        Each pixel's five band values are loaded once and cast to float32 in
+        registers, instead of each index re-reading its bands from memory.
+
+        Args:
+            blue, green, red, nir, swir: 1D band arrays of the same length (raveled rasters)
+            L: SAVI soil brightness correction factor
+            out: (5, N) float32 array receiving NDVI, NDWI, NDMI, EVI and SAVI rows
+        """
+        soil = np.float32(L)
+        zero = np.float32(0)
+        for i in prange(out.shape[1]):
+            b = np.float32(blue[i])
+            g = np.float32(green[i])
+            r = np.float32(red[i])
+            n = np.float32(nir[i])
+            s = np.float32(swir[i])
+            d = n + r
+            out[0, i] = (n - r) / d if d != 0 else zero
+            d = g + n
+            out[1, i] = (g - n) / d if d != 0 else zero
+            d = n + s
+            out[2, i] = (n - s) / d if d != 0 else zero
+            d = n + np.float32(6) * r - np.float32(7.5) * b + np.float32(1)
+            out[3, i] = np.float32(2.5) * (n - r) / d if d != 0 else zero
+            d = n + r + soil
+            out[4, i] = (n - r) / d * (1 + soil) if d != 0 else zero
+
+
+def warmup_kernels():
+    """
+    Compile the kernels used by the worker for the array types they see in production.
+
+    Numba compiles per argument types (dtype, layout and read-only flag), so
+    each kernel is called once on tiny arrays shaped like the real ones:
+    uint16 bands, float32 indices and bool masks, with the cached polygon
+    masks read-only. Compiled code is cached on disk (cache=True), so running
+    this at image build time ships the machine code in the image and the
+    workers only load it on first use instead of JIT-compiling.
+
+    Not to be called in the gunicorn master: running a parallel kernel starts
+    the TBB/OpenMP thread pool, which does not survive the fork into workers.
+    """
+    if not NUMBA_AVAILABLE:
+        return
+
+    band = np.zeros((2, 2), dtype=np.uint16)
+    mask = np.zeros((2, 2), dtype=bool)
+    cached_mask = mask.copy()
+    cached_mask.flags.writeable = False
+    index = np.zeros((2, 2), dtype=np.float32)
+
+    for polygon_mask in (mask, cached_mask):
+        ndvi_to_rgba(index, mask, polygon_mask, 1, np.zeros((2, 2, 4), dtype=np.uint8))
+    ndvi_and_stats(band, band, mask, mask, cached_mask, np.empty_like(index))
+    spectral_indices(band, band, band, band, band, *(np.empty_like(index) for _ in range(4)))
@@ -9,6 +9,8 @@ This module handles:
 """
 
 import os
+import functools
+import random
 import numpy as np
 from datetime import datetime, timedelta
 try:
@@ -22,6 +24,111 @@ except ImportError:
     DEPENDENCIES_AVAILABLE = False
     print("WARNING: Satellite processing dependencies not available. Running in mock mode.")
 
+from cache import TTLCache, geojson_digest
+from ndvi_numba import NUMBA_AVAILABLE
+if NUMBA_AVAILABLE:
+    from ndvi_numba import all_indices, evi_index, normalized_difference_index, savi_index
+
+
+# Mock results per parcel geometry: values stay stable for a parcel for a few
+# minutes and repeated requests skip regenerating them
+_MOCK_RESULTS = TTLCache(maxsize=1024, ttl=300)
+
+# Constant fields of every mock result
+_MOCK_CONSTANTS = {
+    "status": "success",
+    "message": "Satellite indices processed (MOCK MODE - real satellite data requires Copernicus credentials)",
+    "resolution": 10.0,  # meters
+    "source": "sentinel-2",
+    "ndvi_std": 0.12,
+    "image_url": "https://via.placeholder.com/800x600/00ff00/ffffff?text=Satellite+Indices+(Mock)",
+    "info": "To enable real satellite processing, set COPERNICUS_USER and COPERNICUS_PASSWORD env vars",
+}
+
+# Indices are computed and returned in float32: Sentinel-2 reflectances (uint16)
+# and their sums are exact in it, and it halves the bytes moved vs float64
+INDEX_DTYPE = np.float32
+
+# The NumPy index paths work through rasters in blocks of whole rows of about
+# this many pixels, so a block's temporaries stay in L2 cache (1 MB in float32)
+# instead of streaming full-tile arrays through memory once per operation
+BLOCK_PIXELS = 512 * 512
+
+
+def _row_blocks(shape):
+    """Slices over the first axis, each covering about BLOCK_PIXELS pixels."""
+    row_pixels = max(1, int(np.prod(shape[1:])))
+    rows = max(1, BLOCK_PIXELS // row_pixels)
+    return [slice(start, start + rows) for start in range(0, shape[0], rows)]
+
+
+def _normalized_difference(a, b, offset=0):
+    """
+    Compute (a - b) / (a + b + offset), with 0 where the denominator is 0.
+    
+    Each row block runs as ufuncs writing into the output slice and one
+    block-sized sum (the difference is divided in place) instead of
+    allocating a full-size temporary per operation plus the np.where
+    result. The bands are cast to INDEX_DTYPE inside the ufuncs, so
+    unsigned bands do not wrap around.
+    """
+    a, b = np.asarray(a), np.asarray(b)
+    out = np.empty(a.shape, dtype=INDEX_DTYPE)
+    for rows in _row_blocks(out.shape):
+        denominator = np.add(a[rows], b[rows], dtype=INDEX_DTYPE)
+        if offset:
+            denominator += offset
+        np.subtract(a[rows], b[rows], out=out[rows], dtype=INDEX_DTYPE)
+        _divide_or_zero(out[rows], denominator)
+    return out
+
+
+def _enhanced_vegetation_index(blue, red, nir):
+    """
+    Compute 2.5 * (NIR - Red) / (NIR + 6*Red - 7.5*Blue + 1), with 0 where the denominator is 0.
+    
+    Row blocked like _normalized_difference: the denominator is built in one
+    block-sized buffer while the output slice holds 7.5*Blue.
+    """
+    blue, red, nir = np.asarray(blue), np.asarray(red), np.asarray(nir)
+    out = np.empty(nir.shape, dtype=INDEX_DTYPE)
+    for rows in _row_blocks(out.shape):
+        evi = out[rows]
+        np.multiply(blue[rows], 7.5, out=evi, dtype=INDEX_DTYPE)
+        denominator = np.multiply(red[rows], 6, dtype=INDEX_DTYPE)
+        denominator += nir[rows]
+        denominator -= evi
+        denominator += 1
+        np.subtract(nir[rows], red[rows], out=evi, dtype=INDEX_DTYPE)
+        evi *= 2.5
+        _divide_or_zero(evi, denominator)
+    return out
+
+
+def _check_band_shapes(bands):
+    """Raise ValueError unless all bands share one shape (numba kernels do no bounds checks)."""
+    shapes = [np.shape(band) for band in bands]
+    if any(shape != shapes[0] for shape in shapes[1:]):
+        raise ValueError(
+            f"Band shapes differ: {', '.join(map(str, shapes))}; resample the bands to one grid first"
+        )
+
+
+def _raveled_kernel(kernel, bands, *params):
+    """Run a 1D numba index kernel over raveled band rasters, returning an INDEX_DTYPE raster."""
+    _check_band_shapes(bands)
+    out = np.empty(np.shape(bands[0]), dtype=INDEX_DTYPE)
+    kernel(*(np.ravel(band) for band in bands), *params, out.reshape(-1))
+    return out
+
+
+def _divide_or_zero(numerator, denominator):
+    """Divide numerator by denominator in place, setting 0 where the denominator is 0."""
+    nonzero = denominator != 0
+    np.divide(numerator, denominator, out=numerator, where=nonzero)
+    numerator[~nonzero] = 0
+    return numerator
+
 
 class NDVIProcessor:
     def __init__(self):
@@ -56,14 +163,10 @@ class NDVIProcessor:
         Returns:
             numpy array of NDVI values (-1 to 1)
         """
-        # Avoid division by zero
-        denominator = nir_band + red_band
-        ndvi = np.where(
-            denominator != 0,
-            (nir_band - red_band) / denominator,
-            0
-        )
-        return ndvi
+        # Avoid division by zero (both paths write 0 there)
+        if NUMBA_AVAILABLE:
+            return _raveled_kernel(normalized_difference_index, (nir_band, red_band))
+        return _normalized_difference(nir_band, red_band)
     
     def calculate_ndwi(self, green_band, nir_band):
         """
@@ -84,13 +187,9 @@ class NDVIProcessor:
         Returns:
             numpy array of NDWI values (-1 to 1)
         """
-        denominator = green_band + nir_band
-        ndwi = np.where(
-            denominator != 0,
-            (green_band - nir_band) / denominator,
-            0
-        )
-        return ndwi
+        if NUMBA_AVAILABLE:
+            return _raveled_kernel(normalized_difference_index, (green_band, nir_band))
+        return _normalized_difference(green_band, nir_band)
     
     def calculate_ndmi(self, nir_band, swir_band):
         """
@@ -111,13 +210,9 @@ class NDVIProcessor:
         Returns:
             numpy array of NDMI values (-1 to 1)
         """
-        denominator = nir_band + swir_band
-        ndmi = np.where(
-            denominator != 0,
-            (nir_band - swir_band) / denominator,
-            0
-        )
-        return ndmi
+        if NUMBA_AVAILABLE:
+            return _raveled_kernel(normalized_difference_index, (nir_band, swir_band))
+        return _normalized_difference(nir_band, swir_band)
     
     def calculate_evi(self, blue_band, red_band, nir_band):
         """
@@ -140,13 +235,11 @@ class NDVIProcessor:
         Returns:
             numpy array of EVI values (typically -1 to 1, but can exceed for very dense vegetation)
         """
-        denominator = nir_band + 6 * red_band - 7.5 * blue_band + 1
-        evi = np.where(
-            denominator != 0,
-            2.5 * ((nir_band - red_band) / denominator),
-            0
-        )
-        return evi
+        if NUMBA_AVAILABLE:
+            # Fused parallel kernel: no temporaries at all
+            return _raveled_kernel(evi_index, (blue_band, red_band, nir_band))
+        
+        return _enhanced_vegetation_index(blue_band, red_band, nir_band)
     
     def calculate_savi(self, red_band, nir_band, L=0.5):
         """
@@ -165,14 +258,44 @@ class NDVIProcessor:
         Returns:
             numpy array of SAVI values
         """
-        denominator = nir_band + red_band + L
-        savi = np.where(
-            denominator != 0,
-            ((nir_band - red_band) / denominator) * (1 + L),
-            0
-        )
+        if NUMBA_AVAILABLE:
+            return _raveled_kernel(savi_index, (red_band, nir_band), L)
+        
+        savi = _normalized_difference(nir_band, red_band, offset=L)
+        savi *= 1 + L
         return savi
     
+    def calculate_all_indices(self, blue_band, green_band, red_band, nir_band, swir_band, L=0.5):
+        """
+        Calculate NDVI, NDWI, NDMI, EVI and SAVI together.
+        
+        With numba, a single fused pass loads each band once for all five
+        indices; otherwise each index is calculated by its own method. All
+        bands must share one grid (resample SWIR to 10m first).
+        
+        Args:
+            blue_band, green_band, red_band, nir_band, swir_band: numpy arrays of
+                Sentinel-2 Bands 2, 3, 4, 8 and 11
+            L: SAVI soil brightness correction factor (default 0.5)
+            
+        Returns:
+            dict of index arrays keyed by 'ndvi', 'ndwi', 'ndmi', 'evi' and 'savi'
+        """
+        if NUMBA_AVAILABLE:
+            bands = (blue_band, green_band, red_band, nir_band, swir_band)
+            _check_band_shapes(bands)
+            out = np.empty((5, *np.shape(red_band)), dtype=INDEX_DTYPE)
+            all_indices(*(np.ravel(band) for band in bands), L, out.reshape(5, -1))
+            return dict(zip(('ndvi', 'ndwi', 'ndmi', 'evi', 'savi'), out))
+        
+        return {
+            'ndvi': self.calculate_ndvi(red_band, nir_band),
+            'ndwi': self.calculate_ndwi(green_band, nir_band),
+            'ndmi': self.calculate_ndmi(nir_band, swir_band),
+            'evi': self.calculate_evi(blue_band, red_band, nir_band),
+            'savi': self.calculate_savi(red_band, nir_band, L),
+        }
+    
     def query_sentinel_data(self, geojson, start_date, end_date):
         """
         Query Sentinel-2 data for a specific area and time range.
@@ -239,12 +362,15 @@ class NDVIProcessor:
                 "message": "No satellite imagery available for this date range"
             }
         
-        # Get the most recent product with least cloud cover
-        product_df = self.api.to_dataframe(products)
-        best_product = product_df.sort_values(['cloudcoverpercentage', 'beginposition']).iloc[0]
+        # Get the product with least cloud cover, then the earliest (one pass over
+        # the product metadata instead of building and sorting a DataFrame)
+        best_id, best_product = min(
+            products.items(),
+            key=lambda kv: (kv[1]['cloudcoverpercentage'], kv[1]['beginposition'])
+        )
         
         # In a full implementation, you would:
-        # 1. Download the product: self.api.download(best_product.name)
+        # 1. Download the product: self.api.download(best_id)
         # 2. Extract Band 4 (Red) and Band 8 (NIR)
         # 3. Calculate NDVI
         # 4. Clip to parcel geometry
@@ -271,15 +397,17 @@ class NDVIProcessor:
         }
     
     def _mock_process(self, geojson):
-        """Mock processing for development - returns all satellite indices."""
-        import random
+        """Mock processing for development - returns all satellite indices (cached per geometry)."""
+        cache_key = geojson_digest(geojson)
+        cached = _MOCK_RESULTS.get(cache_key)
+        if cached is not None:
+            return dict(cached)
         
         # Generate realistic mock values for olive grove
         ndvi_base = 0.68  # Healthy olive vegetation
         
-        return {
-            "status": "success",
-            "message": "Satellite indices processed (MOCK MODE - real satellite data requires Copernicus credentials)",
+        result = {
+            **_MOCK_CONSTANTS,
             
             # Vegetation indices
             "ndvi": round(ndvi_base + random.uniform(-0.05, 0.05), 3),  # 0.63-0.73 (Good)
@@ -293,35 +421,66 @@ class NDVIProcessor:
             # Metadata
             "product_date": (datetime.now() - timedelta(days=random.randint(3, 10))).strftime('%Y-%m-%d'),
             "cloud_cover": round(random.uniform(5.0, 25.0), 1),
-            "resolution": 10.0,  # meters
-            "source": "sentinel-2",
             
             # Legacy fields for compatibility
             "ndvi_mean": round(ndvi_base, 3),
-            "ndvi_std": 0.12,
-            "image_url": "https://via.placeholder.com/800x600/00ff00/ffffff?text=Satellite+Indices+(Mock)",
-            "info": "To enable real satellite processing, set COPERNICUS_USER and COPERNICUS_PASSWORD env vars"
         }
+        _MOCK_RESULTS.set(cache_key, result)
+        return dict(result)
+
+
+# Palette levels per unit of NDVI. 120 puts level boundaries exactly on the
+# colormap breaks at 0.3 and 0.6, so no level straddles two color bands.
+PALETTE_STEPS = 120
+PALETTE_LEVELS = 2 * PALETTE_STEPS
+
+
+@functools.lru_cache(maxsize=None)
+def _vegetation_palette():
+    """
+    RGB palette for create_ndvi_overlay, sampled from the overlay colormap.
+    
+    Entry 0 is reserved for transparent pixels; entries 1-240 are the
+    Red -> Yellow -> Green colors of NDVI levels spread evenly over [-1, 1],
+    each sampled at the centre of its level.
+    """
+    from image_generator import vegetation_rgba
+    
+    values = ((np.arange(PALETTE_LEVELS) + 0.5) / PALETTE_STEPS - 1).reshape(1, -1)
+    rgba = np.zeros((1, 256, 4), dtype=np.uint8)
+    vegetation_rgba(values, np.ones(values.shape, dtype=bool), rgba[:, 1:PALETTE_LEVELS + 1])
+    return rgba[0, :, :3].tobytes()
 
 
 def create_ndvi_overlay(ndvi_array, output_path, colormap='RdYlGn'):
     """
     Create a colored NDVI overlay image.
     
+    NDVI is quantized to 240 levels and written as a palette PNG (one byte
+    per pixel) colored Red -> Yellow -> Green; masked or invalid pixels are
+    transparent.
+    
     Args:
-        ndvi_array: numpy array of NDVI values
+        ndvi_array: numpy array (or masked array) of NDVI values
         output_path: path to save the output image
         colormap: colormap to use (RdYlGn = Red-Yellow-Green)
     """
     if not DEPENDENCIES_AVAILABLE:
         return None
     
-    # Normalize NDVI from [-1, 1] to [0, 255]
-    normalized = ((ndvi_array + 1) * 127.5).astype(np.uint8)
+    ndvi_data = np.ma.getdata(ndvi_array)
+    valid = ~np.ma.getmaskarray(ndvi_array)
+    valid &= np.isfinite(ndvi_data)
+    
+    # Map NDVI from [-1, 1] to palette entries 1-240 (0 stays transparent).
+    # float64 keeps values just below a colormap break from rounding onto it.
+    levels = np.zeros(ndvi_data.shape, dtype=np.uint8)
+    scaled = np.floor((ndvi_data[valid].astype(np.float64) + 1) * PALETTE_STEPS)
+    levels[valid] = 1 + np.clip(scaled, 0, PALETTE_LEVELS - 1).astype(np.uint8)
     
-    # Create colored image using PIL
-    img = Image.fromarray(normalized, mode='L')
-    img.save(output_path)
+    # Create palette image using PIL
+    img = Image.fromarray(levels)
+    img.putpalette(_vegetation_palette())
+    img.save(output_path, format='PNG', transparency=0, compress_level=1)
     
     return output_path
-